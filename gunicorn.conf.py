@@ -0,0 +1,16 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# One request per process: pdfium and MuPDF are not thread-safe, and each request
+# may fork its own pool of PDF_WORKERS processes, which is only safe from a
+# single-threaded parent. The default stays small because each worker can add
+# those pool processes on top; raise WEB_CONCURRENCY on larger machines.
+# Pool processes reset SIGTERM to the default on start, so a worker that exits
+# or is aborted on timeout takes its pool down with it.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'sync'
+threads = 1
+
+# Large statement and invoice PDFs can take minutes to split and stream
+timeout = 900
@@ -1,15 +1,57 @@
 import os
+import io
 import re
 import json
+import gzip
+import datetime
+import mmap
 import zipfile
+import posixpath
 import tempfile
 import logging
+import signal
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from itertools import chain, islice
 from difflib import get_close_matches
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template_string, request, jsonify, send_file, session
-import PyPDF2
+from flask import Flask, Response, request, jsonify, send_file, session, stream_with_context
 import openpyxl
 
+try:
+    import fitz
+    PDF_LIB = 'pymupdf'
+except ImportError:
+    import PyPDF2
+    PDF_LIB = 'pypdf2'
+
+try:
+    from rapidfuzz import fuzz, process as fuzz_process
+except ImportError:
+    fuzz_process = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'change-this-in-production')
 
@@ -18,40 +60,249 @@ RESULTS_FOLDER = 'results'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# os.cpu_count() reports the host's CPUs inside containers, so deployments can pin this
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', min(os.cpu_count() or 1, 4)))
+PAGES_PER_TASK = 8
+PARALLEL_MIN_PAGES = 32
+INVOICES_PER_TASK = 4
+PARALLEL_MIN_INVOICES = 16
+VALIDATE_MAX_PAGES = 3
+
+COMPANY_NAMES_CACHE_SIZE = 32
+company_names_cache = OrderedDict()
+company_names_lock = threading.Lock()
+
+PDF_DOC_CACHE_SIZE = 8
+pdf_doc_cache = OrderedDict()
+pdf_doc_lock = threading.Lock()
+
+# Source document opened once per pool worker by open_worker_doc_pymupdf
+worker_doc = None
+
+# ASCII-only so the re fallback and Hyperscan (which has no Unicode \b) agree
+INVOICE_PATTERN = re.compile(r'\b[PR]\d{6,8}\b', re.ASCII)
+INVOICE_DATABASE = None
+if hyperscan is not None:
+    # SOM gives match starts
+    INVOICE_DATABASE = hyperscan.Database()
+    INVOICE_DATABASE.compile(
+        expressions=[INVOICE_PATTERN.pattern.encode()],
+        flags=[hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_UTF8]
+    )
+# A database has a single scratch space, so scans must not overlap across threads
+invoice_scan_lock = threading.Lock()
+
+STATEMENT_START_MARKERS = ["914.949.9618", "302.703.8961", "www.unitedcorporate.com", "AR@UNITEDCORPORATE.COM"]
+STATEMENT_END_MARKER = "STATEMENT OF OPEN INVOICE(S)"
+DOWNLOAD_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9]{1,64}')
+ACTIVE_TAB_PATTERN = re.compile(r'<workbookView\b[^>]*\bactiveTab="(\d+)"')
+FIRST_SHEET_PATTERN = re.compile(r'<(?:\w+:)?sheet\b[^>]*\b\w+:id="([^"]+)"')
+SHEET_RELATIONSHIP_PATTERN = re.compile(r'<Relationship\b[^>]*\bId="([^"]+)"[^>]*\bTarget="([^"]+)"|<Relationship\b[^>]*\bTarget="([^"]+)"[^>]*\bId="([^"]+)"')
+# Formula (<f>) and error (t="e") cells, which calamine reads differently from openpyxl
+FORMULA_OR_ERROR_CELL_PATTERN = re.compile(rb'<(?:\w+:)?f[\s/>]|\bt=["\']e["\']')
+EMAIL_PATTERN = re.compile('email', re.IGNORECASE)
+# Group 1 captures any start marker; a match without it is the end marker
+STATEMENT_MARKERS_PATTERN = re.compile(
+    '(' + '|'.join(re.escape(marker) for marker in STATEMENT_START_MARKERS) + ')|' + re.escape(STATEMENT_END_MARKER)
+)
+
 US_STATES = ['AL','AK','AZ','AR','CA','CO','CT','DE','FL','GA','HI','ID','IL','IN','IA','KS','KY','LA','ME','MD','MA','MI','MN','MS','MO','MT','NE','NV','NH','NJ','NM','NY','NC','ND','OH','OK','OR','PA','RI','SC','SD','TN','TX','UT','VT','VA','WA','WV','WI','WY','DC']
 
+# State codes must stand alone, so "CA" inside "CALGARY" is not a match
+US_STATES_PATTERN = re.compile(r'\b(?:' + '|'.join(US_STATES) + r')\b')
+US_STATES_AUTOMATON = None
+if ahocorasick is not None:
+    US_STATES_AUTOMATON = ahocorasick.Automaton()
+    for state in US_STATES:
+        US_STATES_AUTOMATON.add_word(state, state)
+    US_STATES_AUTOMATON.make_automaton()
+
 logging.basicConfig(level=logging.INFO)
 
 def safe_filename(filename):
     return secure_filename(filename)
 
+def save_upload(field_name, directory):
+    # A PUT body is the raw file named by ?name=, which skips multipart parsing
+    # and is copied to disk in large chunks; POST keeps the multipart form field
+    if request.method == 'PUT':
+        filename = safe_filename(request.args.get('name', ''))
+        if not filename:
+            return None
+        file_path = os.path.join(directory, filename)
+        size = 0
+        with open(file_path, 'wb') as file:
+            for chunk in iter(lambda: request.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                file.write(chunk)
+                size += len(chunk)
+        if not size:
+            os.remove(file_path)
+            return None
+        return file_path
+        
+    upload = request.files.get(field_name)
+    if not upload:
+        return None
+    file_path = os.path.join(directory, safe_filename(upload.filename))
+    upload.save(file_path)
+    return file_path
+
+def get_pdf_doc(pdf_path):
+    # The same upload is read by validation, classification and splitting, and a
+    # statement review spans several requests, so keep the parsed document around
+    with pdf_doc_lock:
+        if pdf_path in pdf_doc_cache:
+            pdf_doc_cache.move_to_end(pdf_path)
+            return pdf_doc_cache[pdf_path]
+            
+    doc = fitz.open(pdf_path) if PDF_LIB == 'pymupdf' else open_pdf_reader_pypdf2(pdf_path)
+    
+    with pdf_doc_lock:
+        doc = pdf_doc_cache.setdefault(pdf_path, doc)
+        # Evicted documents are closed once the last request using them drops its reference
+        while len(pdf_doc_cache) > PDF_DOC_CACHE_SIZE:
+            pdf_doc_cache.popitem(last=False)
+    return doc
+
+def open_pdf_reader_pypdf2(pdf_path):
+    # PdfReader would otherwise copy the whole file into a BytesIO; reading through
+    # a read-only map serves pages straight from the page cache. The map outlives
+    # the file handle and is unmapped when the reader is garbage collected.
+    with open(pdf_path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return PyPDF2.PdfReader(mapped)
+
+def release_pdf_doc(pdf_path):
+    with pdf_doc_lock:
+        pdf_doc_cache.pop(pdf_path, None)
+
 def validate_pdf(file_path):
+    if PDF_LIB == 'pymupdf':
+        return validate_pdf_pymupdf(file_path)
+    return validate_pdf_pypdf2(file_path)
+
+def validate_pdf_pymupdf(file_path):
     try:
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            if len(reader.pages) > 0:
-                first_page = reader.pages[0]
-                text = first_page.extract_text()
-                return len(text.strip()) > 0
+        doc = get_pdf_doc(file_path)
+        for page_num in range(min(len(doc), VALIDATE_MAX_PAGES)):
+            # Only a yes/no is needed, so skip the layout flags get_text() uses by default
+            if doc.load_page(page_num).get_text("text", flags=0).strip():
+                return True
         return False
     except:
         return False
 
-def read_excel(file_path):
+def validate_pdf_pypdf2(file_path):
     try:
-        workbook = openpyxl.load_workbook(file_path)
-        sheet = workbook.active
+        reader = get_pdf_doc(file_path)
+        for page_num in range(min(len(reader.pages), VALIDATE_MAX_PAGES)):
+            if reader.pages[page_num].extract_text().strip():
+                return True
+        return False
+    except:
+        return False
+
+def read_excel(file_path, max_col=None):
+    if CalamineWorkbook is not None and calamine_matches_openpyxl(file_path):
+        return read_excel_calamine(file_path, max_col)
+    return read_excel_openpyxl(file_path, max_col)
+
+def calamine_matches_openpyxl(file_path):
+    # calamine opens sheets by position and returns cached results for formulas and blanks
+    # for error cells, where openpyxl reads the active sheet, formula text and error codes.
+    # Files that aren't .xlsx zips (e.g. .xls) can't be opened by openpyxl at all
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            workbook_xml = archive.read('xl/workbook.xml').decode('utf-8', 'ignore')
+            match = ACTIVE_TAB_PATTERN.search(workbook_xml)
+            if match and int(match.group(1)) != 0:
+                return False
+            sheet_path = first_sheet_path(archive, workbook_xml)
+            if sheet_path is None:
+                return False
+            with archive.open(sheet_path) as sheet_xml:
+                return not stream_contains(sheet_xml, FORMULA_OR_ERROR_CELL_PATTERN)
+    except zipfile.BadZipFile:
+        return True
+    except (KeyError, OSError):
+        return False
+
+def first_sheet_path(archive, workbook_xml):
+    match = FIRST_SHEET_PATTERN.search(workbook_xml)
+    if not match:
+        return None
+    rels_xml = archive.read('xl/_rels/workbook.xml.rels').decode('utf-8', 'ignore')
+    for rel in SHEET_RELATIONSHIP_PATTERN.finditer(rels_xml):
+        rel_id, target = (rel.group(1), rel.group(2)) if rel.group(1) else (rel.group(4), rel.group(3))
+        if rel_id == match.group(1):
+            # Targets are relative to xl/ unless they start at the package root
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+    return None
+
+def stream_contains(file, pattern, block_size=1 << 20):
+    # Carry the end of each block over so a match split across blocks is still found
+    tail = b''
+    for block in iter(lambda: file.read(block_size), b''):
+        if pattern.search(tail + block):
+            return True
+        tail = block[-16:]
+    return False
+
+def normalize_calamine_cell(cell):
+    # calamine reports every number as a float, dates as date and blanks as ''; openpyxl
+    # gives ints for whole numbers it can hold exactly, datetimes for dates and None
+    if isinstance(cell, float) and cell.is_integer() and abs(cell) < 2 ** 53:
+        return int(cell)
+    if type(cell) is datetime.date:
+        return datetime.datetime.combine(cell, datetime.time())
+    if cell == '':
+        return None
+    return cell
+
+def read_excel_calamine(file_path, max_col=None):
+    try:
+        sheet = CalamineWorkbook.from_path(file_path).get_sheet_by_index(0)
         data = []
-        for row in sheet.iter_rows(values_only=True):
-            if row[0]:  # Skip empty rows
+        # Keep leading blank rows/columns so column positions match openpyxl
+        for row in sheet.to_python(skip_empty_area=False):
+            row = tuple(normalize_calamine_cell(cell) for cell in row[:max_col])
+            if row and row[0]:  # Skip empty rows
                 data.append(row)
         return data
     except:
         return []
 
+def read_excel_openpyxl(file_path, max_col=None):
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            sheet = workbook.active
+            data = []
+            for row in sheet.iter_rows(max_col=max_col, values_only=True):
+                if row and row[0]:  # Skip empty rows
+                    data.append(row)
+            return data
+        finally:
+            workbook.close()
+    except:
+        return []
+
 @app.route('/')
 def index():
-    return render_template_string(HOME_TEMPLATE)
+    # The page is static, so it is encoded, compressed and tagged once at import
+    if request.accept_encodings['gzip']:
+        response = Response(HOME_PAGE_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(HOME_PAGE_ETAG + '-gzip')
+    else:
+        response = Response(HOME_PAGE, mimetype='text/html')
+        response.set_etag(HOME_PAGE_ETAG)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
 
 @app.route('/api/statement-separator', methods=['POST'])
 def statement_separator():
@@ -69,21 +320,27 @@ def statement_separator():
         pdf_file.save(pdf_path)
         excel_file.save(excel_path)
         
-        if not validate_pdf(pdf_path):
-            return jsonify({'error': 'PDF contains no readable text'}), 400
+        try:
+            if not validate_pdf(pdf_path):
+                release_pdf_doc(pdf_path)
+                return jsonify({'error': 'PDF contains no readable text'}), 400
+                
+            result = process_statements(pdf_path, excel_path)
             
-        result = process_statements(pdf_path, excel_path)
-        
-        if result.get('pending_decisions'):
-            session['temp_data'] = {
-                'pdf_path': pdf_path,
-                'categories': result['categories'],
-                'pending': result['pending_decisions']
-            }
-            return jsonify({'status': 'review', 'decisions': result['pending_decisions']})
-        else:
-            files = create_statement_pdfs(pdf_path, result['categories'])
-            return jsonify({'status': 'complete', 'files': files})
+            if result.get('pending_decisions'):
+                session['temp_data'] = {
+                    'pdf_path': pdf_path,
+                    'categories': result['categories'],
+                    'pending': result['pending_decisions']
+                }
+                return jsonify({'status': 'review', 'decisions': result['pending_decisions']})
+            else:
+                files = create_statement_pdfs(pdf_path, result['categories'])
+                release_pdf_doc(pdf_path)
+                return jsonify({'status': 'complete', 'files': files})
+        except Exception:
+            release_pdf_doc(pdf_path)
+            raise
             
     except Exception as e:
         logging.error(f"Statement separator error: {e}")
@@ -100,69 +357,84 @@ def statement_decision():
         if not temp_data:
             return jsonify({'error': 'Session expired'}), 400
             
-        categories = temp_data['categories']
-        pending = temp_data['pending']
-        
-        pages = [statement['page_num']]  # Simple single page processing
-        
-        if action == 'dnm':
-            categories['dnm'].extend(pages)
-        elif action == 'foreign':
-            categories['foreign'].extend(pages)
-        elif action == 'national':
-            categories['national_single'].extend(pages)
-                
-        pending.remove(statement)
-        
-        if not pending:
-            files = create_statement_pdfs(temp_data['pdf_path'], categories)
-            return jsonify({'status': 'complete', 'files': files})
-        else:
-            session['temp_data'] = temp_data
-            return jsonify({'status': 'continue', 'remaining': len(pending)})
+        try:
+            categories = temp_data['categories']
+            pending = temp_data['pending']
+            
+            pages = [statement['page_num']]  # Simple single page processing
+            
+            if action == 'dnm':
+                categories['dnm'].extend(pages)
+            elif action == 'foreign':
+                categories['foreign'].extend(pages)
+            elif action == 'national':
+                categories['national_single'].extend(pages)
+                    
+            pending.remove(statement)
+            
+            if not pending:
+                files = create_statement_pdfs(temp_data['pdf_path'], categories)
+                release_pdf_doc(temp_data['pdf_path'])
+                return jsonify({'status': 'complete', 'files': files})
+            else:
+                session['temp_data'] = temp_data
+                return jsonify({'status': 'continue', 'remaining': len(pending)})
+        except Exception:
+            release_pdf_doc(temp_data['pdf_path'])
+            raise
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/invoice-processor', methods=['POST'])
+@app.route('/api/invoice-processor', methods=['POST', 'PUT'])
 def invoice_processor():
     try:
-        pdf_file = request.files.get('pdf_file')
-        if not pdf_file:
+        pdf_path = save_upload('pdf_file', tempfile.mkdtemp())
+        if not pdf_path:
             return jsonify({'error': 'PDF file required'}), 400
             
-        temp_dir = tempfile.mkdtemp()
-        pdf_path = os.path.join(temp_dir, safe_filename(pdf_file.filename))
-        pdf_file.save(pdf_path)
-        
-        invoices = extract_invoices(pdf_path)
+        try:
+            invoices = extract_invoices(pdf_path)
+        except Exception:
+            release_pdf_doc(pdf_path)
+            raise
         if not invoices:
+            release_pdf_doc(pdf_path)
             return jsonify({'error': 'No invoices found in PDF'}), 400
             
-        zip_path = create_invoice_zip(pdf_path, invoices)
-        return send_file(zip_path, as_attachment=True, download_name='invoices.zip')
+        # Send each invoice as soon as it is built instead of waiting for the whole archive.
+        # The first invoice is built before responding so that an early failure still
+        # returns a JSON error; a failure after that can only cut the download short.
+        chunks = iter_invoice_zip(pdf_path, invoices)
+        first_chunk = next(chunks)
+        response = Response(
+            stream_with_context(chain([first_chunk], chunks)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=invoices.zip'}
+        )
+        
+        # Lets the page tell that the download has started, which it can't otherwise see
+        download_token = request.values.get('download_token', '')
+        if DOWNLOAD_TOKEN_PATTERN.fullmatch(download_token):
+            response.set_cookie('invoice_download', download_token, max_age=60)
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/excel-processor', methods=['POST'])
+@app.route('/api/excel-processor', methods=['POST', 'PUT'])
 def excel_processor():
     try:
-        excel_file = request.files.get('excel_file')
-        if not excel_file:
+        temp_path = save_upload('excel_file', tempfile.gettempdir())
+        if not temp_path:
             return jsonify({'error': 'Excel file required'}), 400
             
-        temp_path = os.path.join(tempfile.gettempdir(), safe_filename(excel_file.filename))
-        excel_file.save(temp_path)
-        
-        rows = read_excel(temp_path)
-        data = []
-        for row in rows:
-            data.append({
-                'd': str(row[0]) if len(row) > 0 and row[0] else '',
-                's': str(row[1]) if len(row) > 1 and row[1] else '',
-                'w': str(row[2]) if len(row) > 2 and row[2] else ''
-            })
+        rows = read_excel(temp_path, max_col=3)
+        padded_rows = (row + (None,) * (3 - len(row)) for row in rows)
+        data = [
+            {'d': str(d) if d else '', 's': str(s) if s else '', 'w': str(w) if w else ''}
+            for d, s, w in padded_rows
+        ]
             
         os.remove(temp_path)
         return jsonify({'status': 'success', 'data': data})
@@ -178,114 +450,387 @@ def download_file(filename):
     return jsonify({'error': 'File not found'}), 404
 
 def process_statements(pdf_path, excel_path):
-    excel_data = read_excel(excel_path)
-    company_names = [str(row[0]).strip() for row in excel_data if row[0]]
+    if PDF_LIB == 'pymupdf':
+        return process_statements_pymupdf(pdf_path, excel_path)
+    return process_statements_pypdf2(pdf_path, excel_path)
+
+def process_statements_pymupdf(pdf_path, excel_path):
+    company_names = get_company_names(excel_path)
+    
+    return classify_statements(iter_page_texts_pymupdf(pdf_path), company_names)
+
+def process_statements_pypdf2(pdf_path, excel_path):
+    company_names = get_company_names(excel_path)
+    
+    reader = get_pdf_doc(pdf_path)
+    return classify_statements((page.extract_text() for page in reader.pages), company_names)
+
+def iter_page_texts_pymupdf(pdf_path):
+    # Small documents are not worth the cost of starting worker processes
+    doc = get_pdf_doc(pdf_path)
+    page_count = len(doc)
+    if PDF_WORKERS < 2 or page_count < PARALLEL_MIN_PAGES:
+        for page in doc:
+            yield page.get_text()
+        return
+        
+    yield from iter_page_texts_parallel(pdf_path, page_count, extract_page_texts_pymupdf)
+
+def extract_page_texts_pymupdf(task):
+    pdf_path, start, stop = task
+    with fitz.open(pdf_path) as doc:
+        return [doc[page_num].get_text() for page_num in range(start, stop)]
+
+def iter_page_texts_pdfium(pdf_path):
+    # Raw page text via FPDFText_GetBoundedText, without the layout analysis the other backends do
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page_count = len(pdf)
+        if PDF_WORKERS < 2 or page_count < PARALLEL_MIN_PAGES:
+            for page_num in range(page_count):
+                yield read_page_text_pdfium(pdf, page_num)
+            return
+    finally:
+        pdf.close()
+        
+    yield from iter_page_texts_parallel(pdf_path, page_count, extract_page_texts_pdfium)
+
+def extract_page_texts_pdfium(task):
+    pdf_path, start, stop = task
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return [read_page_text_pdfium(pdf, page_num) for page_num in range(start, stop)]
+    finally:
+        pdf.close()
+
+def read_page_text_pdfium(pdf, page_num):
+    page = pdf[page_num]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_bounded()
+    finally:
+        textpage.close()
+        page.close()
+
+def iter_page_texts_parallel(pdf_path, page_count, extract_page_texts):
+    # Documents can't be pickled, so each task reopens the file for its page range
+    tasks = [(pdf_path, start, min(start + PAGES_PER_TASK, page_count))
+             for start in range(0, page_count, PAGES_PER_TASK)]
+    with multiprocessing.Pool(PDF_WORKERS, initializer=init_pool_worker) as pool:
+        for texts in pool.imap(extract_page_texts, tasks):
+            yield from texts
+
+def init_pool_worker():
+    # Pool processes are forked from the server worker and inherit its SIGTERM handler
+    # (gunicorn's only flags the worker to exit), so Pool.terminate() would never stop them
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def get_company_names(excel_path):
+    # Uploads land in a fresh temp dir each time, so key the cache on file contents
+    digest = hashlib.sha256()
+    with open(excel_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    key = digest.hexdigest()
     
+    with company_names_lock:
+        if key in company_names_cache:
+            company_names_cache.move_to_end(key)
+            return company_names_cache[key]
+            
+    excel_data = read_excel(excel_path, max_col=1)
+    company_names = tuple(str(row[0]).strip() for row in excel_data)
+    
+    with company_names_lock:
+        company_names_cache[key] = company_names
+        if len(company_names_cache) > COMPANY_NAMES_CACHE_SIZE:
+            company_names_cache.popitem(last=False)
+    return company_names
+
+def classify_statements(page_texts, company_names):
     categories = {'dnm': [], 'national_single': [], 'foreign': []}
     pending_decisions = []
+    unmatched = []
+    # Exact matches only need a hash lookup; fuzzy matching still wants the ordered list
+    company_names_set = set(company_names)
     
-    start_markers = ["914.949.9618", "302.703.8961", "www.unitedcorporate.com", "AR@UNITEDCORPORATE.COM"]
-    end_marker = "STATEMENT OF OPEN INVOICE(S)"
-    
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
+    # Collect every statement first so fuzzy matching can run as one batch
+    for page_num, text in enumerate(page_texts):
+        bounds = find_statement_bounds(text)
         
-        for page_num, page in enumerate(reader.pages):
-            text = page.extract_text()
-            
-            start_idx = min((text.find(marker) for marker in start_markers if text.find(marker) != -1), default=-1)
-            end_idx = text.find(end_marker)
+        if bounds:
+            extracted_text = text[bounds[0]:bounds[1]].strip()
+            lines = [line.strip() for line in extracted_text.splitlines() if line.strip()]
             
-            if start_idx != -1 and end_idx != -1 and start_idx < end_idx:
-                extracted_text = text[start_idx:end_idx].strip()
-                lines = [line.strip() for line in extracted_text.splitlines() if line.strip()]
-                
-                if lines:
-                    company_name = lines[0]
-                    pages = [page_num + 1]
+            if lines:
+                company_name = lines[0]
+                if company_name in company_names_set:
+                    categories['dnm'].append(page_num + 1)
+                else:
+                    unmatched.append((page_num + 1, company_name, lines, text))
                     
-                    if company_name in company_names:
-                        categories['dnm'].extend(pages)
-                    else:
-                        close_matches = get_close_matches(company_name, company_names, n=1, cutoff=0.8)
-                        if close_matches:
-                            pending_decisions.append({
-                                'page_num': page_num + 1,
-                                'company_name': company_name,
-                                'close_match': close_matches[0],
-                                'total_pages': 1,
-                                'lines': lines[:5]
-                            })
-                        else:
-                            if "email" in text.lower():
-                                categories['dnm'].extend(pages)
-                            elif any(state in ' '.join(lines[1:]) for state in US_STATES):
-                                categories['national_single'].extend(pages)
-                            else:
-                                categories['foreign'].extend(pages)
-                                
+    close_matches = find_close_matches([statement[1] for statement in unmatched], company_names)
+    
+    for (page_num, company_name, lines, text), close_match in zip(unmatched, close_matches):
+        if close_match:
+            pending_decisions.append({
+                'page_num': page_num,
+                'company_name': company_name,
+                'close_match': close_match,
+                'total_pages': 1,
+                'lines': lines[:5]
+            })
+        elif EMAIL_PATTERN.search(text):
+            categories['dnm'].append(page_num)
+        elif has_us_state(' '.join(lines[1:])):
+            categories['national_single'].append(page_num)
+        else:
+            categories['foreign'].append(page_num)
+            
     return {'categories': categories, 'pending_decisions': pending_decisions}
 
+def find_statement_bounds(text):
+    # Only the first end marker matters, so the scan stops there
+    start_idx = -1
+    for match in STATEMENT_MARKERS_PATTERN.finditer(text):
+        if match.lastindex:
+            if start_idx == -1:
+                start_idx = match.start()
+        else:
+            return (start_idx, match.start()) if start_idx != -1 else None
+    return None
+
+def has_us_state(text):
+    if US_STATES_AUTOMATON is None:
+        return US_STATES_PATTERN.search(text) is not None
+        
+    for end_idx, state in US_STATES_AUTOMATON.iter(text):
+        start_idx = end_idx - len(state) + 1
+        if start_idx > 0 and is_word_char(text[start_idx - 1]):
+            continue
+        if end_idx + 1 < len(text) and is_word_char(text[end_idx + 1]):
+            continue
+        return True
+    return False
+
+def is_word_char(char):
+    # Same as the regex \w that bounds US_STATES_PATTERN: letters, digits and underscore
+    return char.isalnum() or char == '_'
+
+def find_close_matches(queries, company_names):
+    if not queries or not company_names:
+        return [None] * len(queries)
+        
+    if fuzz_process is not None:
+        # Scores below the cutoff come back as 0, so a zero best score means no match
+        scores = fuzz_process.cdist(queries, company_names, scorer=fuzz.ratio, score_cutoff=80, workers=PDF_WORKERS)
+        best = scores.argmax(axis=1)
+        return [company_names[idx] if scores[row, idx] else None for row, idx in enumerate(best)]
+        
+    matches = []
+    for query in queries:
+        close_matches = get_close_matches(query, company_names, n=1, cutoff=0.8)
+        matches.append(close_matches[0] if close_matches else None)
+    return matches
+
 def create_statement_pdfs(pdf_path, categories):
+    if PDF_LIB == 'pymupdf':
+        return create_statement_pdfs_pymupdf(pdf_path, categories)
+    return create_statement_pdfs_pypdf2(pdf_path, categories)
+
+def create_statement_pdfs_pymupdf(pdf_path, categories):
     files = []
     
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        
-        for name, pages in categories.items():
-            if pages:
-                writer = PyPDF2.PdfWriter()
-                for page_num in sorted(set(pages)):
-                    if 0 <= page_num - 1 < len(reader.pages):
-                        writer.add_page(reader.pages[page_num - 1])
-                        
-                if len(writer.pages) > 0:
-                    filename = f"{name}.pdf"
-                    file_path = os.path.join(RESULTS_FOLDER, filename)
-                    with open(file_path, 'wb') as output_file:
-                        writer.write(output_file)
-                    files.append(filename)
+    doc = get_pdf_doc(pdf_path)
+    
+    for name, pages in categories.items():
+        if pages:
+            output_doc = fitz.open()
+            page_indexes = [page_num - 1 for page_num in pages]
+            for first, last in page_runs(page_indexes, len(doc)):
+                output_doc.insert_pdf(doc, from_page=first, to_page=last)
+                
+            if len(output_doc) > 0:
+                filename = f"{name}.pdf"
+                output_doc.save(os.path.join(RESULTS_FOLDER, filename))
+                files.append(filename)
+            output_doc.close()
+            
+    return files
+
+def create_statement_pdfs_pypdf2(pdf_path, categories):
+    files = []
+    
+    reader = get_pdf_doc(pdf_path)
+    
+    for name, pages in categories.items():
+        if pages:
+            writer = PyPDF2.PdfWriter()
+            page_indexes = [page_num - 1 for page_num in pages]
+            for first, last in page_runs(page_indexes, len(reader.pages)):
+                for page_index in range(first, last + 1):
+                    writer.add_page(reader.pages[page_index])
                     
+            if len(writer.pages) > 0:
+                filename = f"{name}.pdf"
+                file_path = os.path.join(RESULTS_FOLDER, filename)
+                with open(file_path, 'wb') as output_file:
+                    writer.write(output_file)
+                files.append(filename)
+                
     return files
 
+def page_runs(pages, page_count):
+    # One byte per page: marking is a single pass, and scanning the marks with
+    # bytearray.find yields each run in order with no sort or de-duplication
+    marks = bytearray(page_count)
+    for page in pages:
+        if 0 <= page < page_count:
+            marks[page] = 1
+            
+    first = marks.find(1)
+    while first != -1:
+        end = marks.find(0, first)
+        if end == -1:
+            end = page_count
+        yield first, end - 1
+        first = marks.find(1, end)
+
 def extract_invoices(pdf_path):
-    pattern = r'\b[PR]\d{6,8}\b'
+    # Invoice numbers never need layout, so pypdfium2 is preferred whatever PDF_LIB is
+    if pdfium is not None:
+        return extract_invoices_pdfium(pdf_path)
+    if PDF_LIB == 'pymupdf':
+        return extract_invoices_pymupdf(pdf_path)
+    return extract_invoices_pypdf2(pdf_path)
+
+def extract_invoices_pymupdf(pdf_path):
+    return collect_invoices(enumerate(iter_page_texts_pymupdf(pdf_path)))
+
+def extract_invoices_pdfium(pdf_path):
+    return collect_invoices(enumerate(iter_page_texts_pdfium(pdf_path)))
+
+def extract_invoices_pypdf2(pdf_path):
+    reader = get_pdf_doc(pdf_path)
+    return collect_invoices(enumerate(page.extract_text() for page in reader.pages))
+
+def collect_invoices(page_texts):
     invoices = {}
     
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
+    for page_num, text in page_texts:
+        invoice_numbers = find_invoice_numbers(text)
         
-        for page_num, page in enumerate(reader.pages):
-            text = page.extract_text()
-            invoice_numbers = re.findall(pattern, text)
-            
-            for invoice_number in invoice_numbers:
-                if invoice_number not in invoices:
-                    invoices[invoice_number] = []
-                invoices[invoice_number].append(page_num)
-                
+        for invoice_number in invoice_numbers:
+            if invoice_number not in invoices:
+                invoices[invoice_number] = []
+            invoices[invoice_number].append(page_num)
+            
     return invoices
 
-def create_invoice_zip(pdf_path, invoices):
-    zip_path = os.path.join(RESULTS_FOLDER, 'invoices.zip')
+def find_invoice_numbers(text):
+    if INVOICE_DATABASE is None:
+        return INVOICE_PATTERN.findall(text)
+        
+    data = text.encode('utf-8')
+    invoice_numbers = []
     
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
+    def on_match(pattern_id, start, end, flags, context):
+        invoice_numbers.append(data[start:end].decode('utf-8'))
         
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for invoice_number, pages in invoices.items():
-                writer = PyPDF2.PdfWriter()
-                for page_num in pages:
-                    writer.add_page(reader.pages[page_num])
-                    
-                if len(writer.pages) > 0:
-                    temp_path = f"/tmp/{invoice_number}.pdf"
-                    with open(temp_path, 'wb') as temp_file:
-                        writer.write(temp_file)
-                    zipf.write(temp_path, f"{invoice_number}.pdf")
-                    os.remove(temp_path)
-                    
-    return zip_path
+    with invoice_scan_lock:
+        INVOICE_DATABASE.scan(data, match_event_handler=on_match)
+    return invoice_numbers
+
+class ZipChunkWriter(io.RawIOBase):
+    # Write-only sink for ZipFile; being unseekable makes ZipFile emit data
+    # descriptors so every member can be sent as soon as it is written
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        
+    def writable(self):
+        return True
+        
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+        
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_invoice_zip(pdf_path, invoices):
+    stream = ZipChunkWriter()
+    try:
+        # PDFs are already compressed, so deflating them again only costs CPU
+        with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as zipf:
+            for invoice_number, pdf_bytes in iter_invoice_pdfs(pdf_path, invoices):
+                if pdf_bytes:
+                    zipf.writestr(f"{invoice_number}.pdf", pdf_bytes)
+                    yield stream.drain()
+        yield stream.drain()
+    finally:
+        release_pdf_doc(pdf_path)
+
+def iter_invoice_pdfs(pdf_path, invoices):
+    if PDF_LIB == 'pymupdf':
+        return iter_invoice_pdfs_pymupdf(pdf_path, invoices)
+    return iter_invoice_pdfs_pypdf2(pdf_path, invoices)
+
+def iter_invoice_pdfs_pymupdf(pdf_path, invoices):
+    if PDF_WORKERS < 2 or len(invoices) < PARALLEL_MIN_INVOICES:
+        doc = get_pdf_doc(pdf_path)
+        for invoice_number, pages in invoices.items():
+            yield invoice_number, build_invoice_pdf_pymupdf(doc, pages)
+        return
+        
+    # Each worker opens the source once and builds invoices from it. Only a few batches
+    # are in flight at a time, so finished PDFs don't pile up while a slow client reads
+    # the stream; imap would queue every invoice up front
+    items = iter(invoices.items())
+    pending = deque()
+    with multiprocessing.Pool(PDF_WORKERS, initializer=open_worker_doc_pymupdf, initargs=(pdf_path,)) as pool:
+        while True:
+            while len(pending) < PDF_WORKERS * 2:
+                batch = list(islice(items, INVOICES_PER_TASK))
+                if not batch:
+                    break
+                pending.append(pool.apply_async(build_worker_invoice_pdfs_pymupdf, (batch,)))
+            if not pending:
+                return
+            yield from pending.popleft().get()
+
+def open_worker_doc_pymupdf(pdf_path):
+    global worker_doc
+    init_pool_worker()
+    worker_doc = fitz.open(pdf_path)
+
+def build_worker_invoice_pdfs_pymupdf(batch):
+    return [(invoice_number, build_invoice_pdf_pymupdf(worker_doc, pages)) for invoice_number, pages in batch]
+
+def build_invoice_pdf_pymupdf(doc, pages):
+    output_doc = fitz.open()
+    try:
+        for first, last in page_runs(pages, len(doc)):
+            output_doc.insert_pdf(doc, from_page=first, to_page=last)
+        return output_doc.tobytes() if len(output_doc) > 0 else None
+    finally:
+        output_doc.close()
+
+def iter_invoice_pdfs_pypdf2(pdf_path, invoices):
+    reader = get_pdf_doc(pdf_path)
+    
+    for invoice_number, pages in invoices.items():
+        writer = PyPDF2.PdfWriter()
+        for first, last in page_runs(pages, len(reader.pages)):
+            for page_index in range(first, last + 1):
+                writer.add_page(reader.pages[page_index])
+            
+        if len(writer.pages) > 0:
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            yield invoice_number, buffer.getvalue()
 
 HOME_TEMPLATE = '''
 <!DOCTYPE html>
@@ -364,11 +909,15 @@ HOME_TEMPLATE = '''
                 <p>Extract and separate individual invoices from a combined PDF file using pattern recognition.</p>
                 <div class="upload-area" id="inv-upload">
                     <p>Drop PDF file here or click to select</p>
-                    <input type="file" id="inv-pdf" accept=".pdf" style="display:none">
+                    <form id="inv-form" method="POST" action="/api/invoice-processor" enctype="multipart/form-data" target="inv-download">
+                        <input type="file" id="inv-pdf" name="pdf_file" accept=".pdf" style="display:none">
+                        <input type="hidden" name="download_token">
+                    </form>
                     <div class="file-info" id="inv-files"></div>
                 </div>
                 <button class="btn" onclick="processInvoices()" id="inv-btn" disabled>Extract Invoices</button>
                 <div id="inv-result" class="result hidden"></div>
+                <iframe name="inv-download" id="inv-download" class="hidden"></iframe>
             </div>
 
             <!-- Excel Processor -->
@@ -472,6 +1021,8 @@ HOME_TEMPLATE = '''
         setupUpload('excel-upload', ['excel-file'], 'excel-btn', 'excel-files');
         
         // Processing functions
+        const INVOICE_TIMEOUT_MS = 15 * 60 * 1000;  // matches the gunicorn request timeout
+        
         async function processStatements() {
             const btn = document.getElementById('stmt-btn');
             const result = document.getElementById('stmt-result');
@@ -526,21 +1077,23 @@ HOME_TEMPLATE = '''
                     <h4>Statement ${index + 1}: "${decision.company_name}"</h4>
                     <p><strong>Suggested match:</strong> ${decision.close_match}</p>
                     <div class="decision-buttons">
-                        <button class="btn-dnm" onclick="makeDecision(${index}, 'dnm')">DNM List</button>
-                        <button class="btn-national" onclick="makeDecision(${index}, 'national')">National</button>
-                        <button class="btn-foreign" onclick="makeDecision(${index}, 'foreign')">Foreign</button>
+                        <button class="btn-dnm" data-action="dnm">DNM List</button>
+                        <button class="btn-national" data-action="national">National</button>
+                        <button class="btn-foreign" data-action="foreign">Foreign</button>
                     </div>
                 `;
+                // Buttons hold their own decision and panel, so removing one panel never
+                // shifts the others; the panel stays out of the decision sent to the server
+                panel.querySelectorAll('button[data-action]').forEach(button => {
+                    button.addEventListener('click', () => makeDecision(decision, panel, button.dataset.action));
+                });
                 container.appendChild(panel);
             });
             
             container.classList.remove('hidden');
-            window.currentDecisions = decisionsData;
         }
         
-        async function makeDecision(index, action) {
-            const decision = window.currentDecisions[index];
-            
+        async function makeDecision(decision, panel, action) {
             try {
                 const response = await fetch('/api/statement-decision', {
                     method: 'POST',
@@ -551,8 +1104,7 @@ HOME_TEMPLATE = '''
                 const data = await response.json();
                 
                 // Remove the decided panel
-                document.getElementsByClassName('decision-panel')[index].remove();
-                window.currentDecisions.splice(index, 1);
+                panel.remove();
                 
                 if (data.status === 'complete') {
                     document.getElementById('stmt-decisions').classList.add('hidden');
@@ -566,9 +1118,14 @@ HOME_TEMPLATE = '''
             }
         }
         
-        async function processInvoices() {
+        function processInvoices() {
             const btn = document.getElementById('inv-btn');
             const result = document.getElementById('inv-result');
+            const frame = document.getElementById('inv-download');
+            const form = document.getElementById('inv-form');
+            const token = Date.now().toString(36) + Math.random().toString(36).slice(2);
+            const startedAt = Date.now();
+            let poll;
             
             btn.disabled = true;
             btn.textContent = 'Processing...';
@@ -576,36 +1133,38 @@ HOME_TEMPLATE = '''
             result.innerHTML = 'Extracting invoices...';
             result.classList.remove('hidden');
             
-            const formData = new FormData();
-            formData.append('pdf_file', document.getElementById('inv-pdf').files[0]);
+            function finish(className, html) {
+                clearInterval(poll);
+                frame.onload = null;
+                result.className = className;
+                result.innerHTML = html;
+                btn.disabled = false;
+                btn.textContent = 'Extract Invoices';
+            }
             
-            try {
-                const response = await fetch('/api/invoice-processor', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                if (response.ok) {
-                    const blob = await response.blob();
-                    const url = window.URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = url;
-                    a.download = 'invoices.zip';
-                    a.click();
-                    
-                    result.className = 'result success';
-                    result.innerHTML = '<p>✅ Invoices extracted successfully! Download started.</p>';
-                } else {
-                    const data = await response.json();
-                    throw new Error(data.error || 'Processing failed');
+            // The form posts into a hidden frame so the browser saves the streamed ZIP
+            // straight to disk. A successful download never loads the frame; only an
+            // error response does, and that response is JSON.
+            frame.onload = () => {
+                let message = 'Processing failed';
+                try {
+                    message = JSON.parse(frame.contentDocument.body.textContent).error || message;
+                } catch (error) {}
+                finish('result error', `<p>❌ Error: ${message}</p>`);
+            };
+            
+            // The server echoes the token as a cookie on the ZIP response, which is
+            // the only sign the page gets that the download has started
+            poll = setInterval(() => {
+                if (document.cookie.split('; ').includes('invoice_download=' + token)) {
+                    finish('result success', '<p>✅ Invoices extracted successfully! Download started.</p>');
+                } else if (Date.now() - startedAt > INVOICE_TIMEOUT_MS) {
+                    finish('result error', '<p>❌ Error: The server did not respond in time. Please try again.</p>');
                 }
-            } catch (error) {
-                result.className = 'result error';
-                result.innerHTML = `<p>❌ Error: ${error.message}</p>`;
-            }
+            }, 500);
             
-            btn.disabled = false;
-            btn.textContent = 'Extract Invoices';
+            form.elements.download_token.value = token;
+            form.submit();
         }
         
         async function processExcel() {
@@ -618,13 +1177,14 @@ HOME_TEMPLATE = '''
             result.innerHTML = 'Processing Excel data...';
             result.classList.remove('hidden');
             
-            const formData = new FormData();
-            formData.append('excel_file', document.getElementById('excel-file').files[0]);
+            // Send the file itself as the body so the browser streams it from disk
+            const file = document.getElementById('excel-file').files[0];
             
             try {
-                const response = await fetch('/api/excel-processor', {
-                    method: 'POST',
-                    body: formData
+                const response = await fetch('/api/excel-processor?name=' + encodeURIComponent(file.name), {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file
                 });
                 
                 const data = await response.json();
@@ -656,5 +1216,11 @@ ${JSON.stringify(data.data.slice(0, 5), null, 2)}${data.data.length > 5 ? '\\n..
 </html>
 '''
 
+HOME_PAGE = HOME_TEMPLATE.encode('utf-8')
+HOME_PAGE_GZIP = gzip.compress(HOME_PAGE, 9)
+HOME_PAGE_ETAG = hashlib.blake2b(HOME_PAGE, digest_size=8).hexdigest()
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
+    # Production runs under gunicorn (see gunicorn.conf.py); the reloader and debugger are opt-in.
+    # Requests are handled one at a time because the PDF libraries are not thread-safe.
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), threaded=False)
\ No newline at end of file